@@ -0,0 +1,539 @@
+"""
+End-to-end benchmark for the export -> vault -> ingest -> chat pipeline.
+
+Generates a synthetic ChatGPT export and markdown vault in a scratch directory,
+starts a local stand-in for the Supabase REST/RPC and OpenAI endpoints, then
+runs each real script against them in its own process and appends one JSON
+line per run (throughput, latency, peak memory, per-stage timings) to the
+results file.
+
+    python bench_pipeline.py --conversations 500 --notes 1000 --queries 20
+
+The sentence-transformers model still runs for real, so it must be cached
+locally (or downloadable) for the ingest/watch/chat stages.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+SCRIPTS_DIR = Path(__file__).parent
+RESULTS_FILE = SCRIPTS_DIR / "bench_results.jsonl"
+STAGES = ["convert", "ingest", "docs", "watch", "chat"]
+FAKE_KEY = "bench.stand-in.key"   # shaped like a JWT so supabase-py accepts it
+OPENAI_DIM = 1536
+
+WORDS = (
+    "agent model prompt vector embedding supabase vault note chunk token "
+    "motorcycle bike repair chain sprocket carburetor torque bolt "
+    "prepper disaster survival squad water radio map shelter "
+    "python script error fix loop function class module test "
+    "idea plan build guide setup config server local cloud index"
+).split()
+TITLES = [
+    "AI assistant setup", "GPT model tuning", "FPA squad planning", "Disaster water plan",
+    "Motorcycle chain repair", "Bike carburetor fix", "Python script notes", "Weekend ideas",
+]
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def _paragraph(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def generate_export(export_dir: Path, n_conversations: int, turns: int, seed: int = 0) -> int:
+    """Write conversations.json in the ChatGPT export `mapping` layout."""
+    rng = random.Random(seed)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    base_time = 1_700_000_000
+    conversations = []
+    for c in range(n_conversations):
+        mapping = {}
+        created = base_time + c * 3600
+        parent = None
+        for t in range(turns * 2):
+            node_id = f"c{c}-m{t}"
+            role = "user" if t % 2 == 0 else "assistant"
+            n_words = rng.randint(8, 30) if role == "user" else rng.randint(80, 400)
+            mapping[node_id] = {
+                "id": node_id,
+                "parent": parent,
+                "children": [],
+                "message": {
+                    "id": node_id,
+                    "author": {"role": role},
+                    "create_time": created + t * 30,
+                    "content": {"content_type": "text", "parts": [_paragraph(rng, n_words)]},
+                },
+            }
+            if parent:
+                mapping[parent]["children"].append(node_id)
+            parent = node_id
+        conversations.append({
+            "id": f"conv-{c}",
+            "title": f"{rng.choice(TITLES)} {c}",
+            "create_time": created,
+            "update_time": created + turns * 60,
+            "mapping": mapping,
+        })
+    with open(export_dir / "conversations.json", "w", encoding="utf-8") as f:
+        json.dump(conversations, f)
+    return n_conversations
+
+
+def generate_vault(vault_dir: Path, n_notes: int, seed: int = 0) -> int:
+    """Write `n_notes` markdown notes of varying length under vault_dir."""
+    rng = random.Random(seed)
+    for i in range(n_notes):
+        folder = vault_dir / rng.choice(["Notes", "Projects", "Journal"])
+        folder.mkdir(parents=True, exist_ok=True)
+        paragraphs = [_paragraph(rng, rng.randint(40, 200)) for _ in range(rng.randint(1, 12))]
+        (folder / f"note_{i:05d}.md").write_text(
+            f"# {rng.choice(TITLES)} {i}\n\n" + "\n\n".join(paragraphs) + "\n", encoding="utf-8"
+        )
+    return n_notes
+
+
+def duplicate_notes(vault_dir: Path, fraction: float, seed: int = 2) -> int:
+    """Copy a fraction of notes with a one-word edit, as repeated exports/pastes would."""
+    rng = random.Random(seed)
+    notes = sorted(vault_dir.rglob("*.md"))
+    copies = rng.sample(notes, int(len(notes) * fraction)) if notes else []
+    for path in copies:
+        words = path.read_text(encoding="utf-8").split(" ")
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+        path.with_name(f"{path.stem}_copy.md").write_text(" ".join(words), encoding="utf-8")
+    return len(copies)
+
+
+def touch_notes(vault_dir: Path, fraction: float, seed: int = 1) -> int:
+    """Append a line to a fraction of notes so the watcher has edits to reconcile."""
+    rng = random.Random(seed)
+    notes = sorted(vault_dir.rglob("*.md"))
+    edited = rng.sample(notes, int(len(notes) * fraction)) if notes else []
+    for path in edited:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(f"\n{_paragraph(rng, 20)}\n")
+    return len(edited)
+
+
+# ---------------------------------------------------------------------------
+# Supabase / OpenAI stand-in
+# ---------------------------------------------------------------------------
+
+def fake_embedding(text: str, dim: int = OPENAI_DIM) -> List[float]:
+    """Deterministic unit vector seeded from the text hash."""
+    seed = int.from_bytes(hashlib.md5(text.encode()).digest()[:4], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Minimal PostgREST + OpenAI surface used by the scripts:
+    POST /rest/v1/<table> (insert/upsert), GET /rest/v1/<table> (select, count),
+    DELETE /rest/v1/<table> (eq / not.in filters), POST /rest/v1/rpc/match_crawled_pages, POST /v1/embeddings,
+    POST /v1/chat/completions.
+    """
+    tables: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    lock = threading.Lock()
+    serial = itertools.count()   # ids for rows inserted without one
+    latency = 0.0   # optional simulated network delay per request (seconds)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        path = urlparse(self.path).path
+        if not path.startswith("/rest/v1/"):
+            return self._send(404, {"error": "not found"})
+        table = path.rsplit("/", 1)[-1]
+        with self.lock:
+            rows = [{k: v for k, v in r.items() if k != "embedding"}
+                    for r in self.tables.get(table, {}).values()]
+        self._send(200, rows, {"Content-Range": f"0-{max(len(rows) - 1, 0)}/{len(rows)}"})
+
+    @staticmethod
+    def _field(row: Dict[str, Any], column: str) -> Any:
+        if "->>" in column:
+            column, key = column.split("->>", 1)
+            return str((row.get(column) or {}).get(key))
+        return str(row.get(column))
+
+    def do_DELETE(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        if not url.path.startswith("/rest/v1/"):
+            return self._send(404, {"error": "not found"})
+        table = url.path.rsplit("/", 1)[-1]
+        filters = []
+        for column, expr in parse_qsl(url.query):
+            if expr.startswith("eq."):
+                filters.append(lambda r, c=column, v=expr[3:]: self._field(r, c) == v)
+            elif expr.startswith("not.in.("):
+                values = {v.strip('"') for v in expr[8:-1].split(",")}
+                filters.append(lambda r, c=column, vs=values: self._field(r, c) not in vs)
+        with self.lock:
+            stored = self.tables.get(table, {})
+            doomed = [key for key, row in stored.items() if all(f(row) for f in filters)]
+            removed = [stored.pop(key) for key in doomed]
+        self._send(200, [{k: v for k, v in r.items() if k != "embedding"} for r in removed])
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        path = urlparse(self.path).path
+        body = self._body()
+        if path == "/rest/v1/rpc/match_crawled_pages":
+            return self._send(200, self._match(body))
+        if path.startswith("/rest/v1/"):
+            table = path.rsplit("/", 1)[-1]
+            rows = body if isinstance(body, list) else [body]
+            with self.lock:
+                stored = self.tables.setdefault(table, {})
+                for row in rows:
+                    key = str(row.get("id") or f"auto-{next(self.serial)}")
+                    stored[key] = dict(row, id=key)
+            return self._send(201, rows)
+        if path.endswith("/embeddings"):
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            return self._send(200, {
+                "object": "list",
+                "model": body.get("model"),
+                "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(t)}
+                         for i, t in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        if path.endswith("/chat/completions"):
+            return self._send(200, {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "Stand-in answer."},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        self._send(404, {"error": "not found"})
+
+    def _match(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        query = np.asarray(body["query_embedding"], dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        # Same pre-filter as sql/crawled_pages_metadata.sql, applied before scoring
+        folder = (body.get("filter_folder") or "").strip("/")
+        date_from, date_to = body.get("date_from"), body.get("date_to")
+
+        def wanted(row):
+            meta = row.get("metadata") or {}
+            row_folder, created = meta.get("folder") or "", meta.get("created_at")
+            if folder and not (row_folder == folder or row_folder.startswith(folder + "/")):
+                return False
+            if date_from and (created is None or created < date_from):
+                return False
+            if date_to and (created is None or created >= date_to):
+                return False
+            return True
+
+        with self.lock:
+            rows = [r for r in self.tables.get("crawled_pages", {}).values() if wanted(r)]
+        if not rows:
+            return []
+        matrix = np.asarray([r["embedding"] for r in rows], dtype=np.float32)
+        scores = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1), 1e-12)
+        order = np.argsort(-scores)[:body.get("match_count", 5)]
+        return [
+            dict({k: v for k, v in rows[i].items() if k != "embedding"}, similarity=float(scores[i]))
+            for i in order if scores[i] >= body.get("match_threshold", 0)
+        ]
+
+
+def start_stand_in(latency: float = 0.0) -> ThreadingHTTPServer:
+    StandInHandler.tables = {}
+    StandInHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# Stage runner
+# ---------------------------------------------------------------------------
+
+# Runs a script as __main__ and records its peak RSS, even if it exits early
+_RUNNER = """
+import json, runpy, sys
+script, out = sys.argv[1], sys.argv[2]
+sys.argv = [script] + sys.argv[3:]
+sys.path.insert(0, str(__import__('pathlib').Path(script).parent))
+try:
+    runpy.run_path(script, run_name="__main__")
+finally:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        peak_mb = None   # resource is POSIX-only
+    with open(out, "w") as f:
+        json.dump({"peak_rss_mb": peak_mb and round(peak_mb, 1)}, f)
+"""
+
+
+def run_stage(name: str, script: Path, args: List[str], env: Dict[str, str], work: Path,
+              items: int, unit: str) -> Dict[str, Any]:
+    """Run one script in a fresh interpreter and collect timing/memory/metrics."""
+    stats_file = work / f"{name}_rss.json"
+    metrics_file = work / f"{name}_metrics.json"
+    stage_env = dict(env, METRICS_FILE=str(metrics_file))
+    log_file = work / f"{name}.log"
+
+    start = time.perf_counter()
+    with open(log_file, "w", encoding="utf-8") as log:
+        proc = subprocess.run(
+            [sys.executable, "-c", _RUNNER, str(script), str(stats_file), *args],
+            cwd=work, env=stage_env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    wall = time.perf_counter() - start
+
+    result = {
+        "stage": name,
+        "ok": proc.returncode == 0,
+        "wall_s": round(wall, 3),
+        "items": items,
+        "unit": unit,
+        "throughput_per_s": round(items / wall, 2) if wall and proc.returncode == 0 else None,
+        "peak_rss_mb": None,
+        "log": str(log_file),
+    }
+    if stats_file.exists():
+        result["peak_rss_mb"] = json.loads(stats_file.read_text())["peak_rss_mb"]
+    if metrics_file.exists():
+        stage_metrics = json.loads(metrics_file.read_text())
+        result["stages"] = stage_metrics["stages"]
+        result["counters"] = stage_metrics["counters"]
+    return result
+
+
+def chat_driver(queries: int, folder: str = "", seed: int = 0):
+    """
+    Drive pkm_chat headlessly with streamlit's AppTest, one chat turn per query.
+    With `folder`, the second half of the queries use the sidebar folder filter
+    and every returned source is checked against it.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    app = AppTest.from_file(str(SCRIPTS_DIR / "pkm_chat.py"), default_timeout=300)
+    app.run()
+    latencies = {"unfiltered": [], "filtered": []}
+    violations = returned = 0
+    for q in range(queries):
+        filtered = bool(folder) and q >= queries // 2
+        if filtered and q == queries // 2:
+            app.sidebar.text_input[0].set_value(folder)
+        question = f"How do I {rng.choice(WORDS)} the {rng.choice(WORDS)}?"
+        start = time.perf_counter()
+        app.chat_input[0].set_value(question).run()
+        latencies["filtered" if filtered else "unfiltered"].append(time.perf_counter() - start)
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+        if filtered:
+            sources = app.session_state["messages"][-1].get("sources", [])
+            returned += len(sources)
+            violations += sum(
+                1 for src in sources
+                if not ((src.get("metadata") or {}).get("folder") or "").startswith(folder)
+            )
+    print(json.dumps({"latencies_s": latencies, "filtered_sources": returned, "filter_violations": violations}))
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def compare_with_previous(results_file: Path, run: Dict[str, Any]) -> List[str]:
+    """Per-stage wall-time change against the last recorded run with the same params."""
+    if not results_file.exists():
+        return []
+    params = json.loads(json.dumps(run["params"]))   # as it reads back from the file
+    previous = None
+    for line in reversed(results_file.read_text(encoding="utf-8").strip().splitlines()):
+        if line.strip():
+            earlier = json.loads(line)
+            if earlier.get("params") == params:
+                previous = {s["stage"]: s for s in earlier["stages"]}
+                break
+    if previous is None:
+        return []
+    notes = []
+    for stage in run["stages"]:
+        before = previous.get(stage["stage"])
+        if before and before["ok"] and stage["ok"] and before["wall_s"]:
+            delta = (stage["wall_s"] - before["wall_s"]) / before["wall_s"] * 100
+            notes.append(f"   {stage['stage']:<8} {before['wall_s']:.2f}s -> {stage['wall_s']:.2f}s ({delta:+.1f}%)")
+    return notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark with local stand-ins")
+    parser.add_argument("--conversations", type=int, default=200, help="Synthetic conversations in the export")
+    parser.add_argument("--turns", type=int, default=4, help="User/assistant turn pairs per conversation")
+    parser.add_argument("--notes", type=int, default=300, help="Extra synthetic notes in the vault")
+    parser.add_argument("--queries", type=int, default=10, help="pkm_chat questions to ask")
+    parser.add_argument("--dup-fraction", type=float, default=0.1, help="Share of notes duplicated with a small edit")
+    parser.add_argument("--edit-fraction", type=float, default=0.1, help="Share of notes edited before the watcher pass")
+    parser.add_argument("--chat-folder", default="Motorcycle_Fixes",
+                        help="Folder filter for the second half of chat queries ('' to disable)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated stand-in latency per request (s)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {STAGES}")
+    parser.add_argument("--store", choices=["supabase", "local"], default="supabase", help="VECTOR_STORE backend")
+    parser.add_argument("--work", type=Path, help="Scratch directory (default: temp dir, removed afterwards)")
+    parser.add_argument("--out", type=Path, default=RESULTS_FILE, help="Results file (JSON lines)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chat-driver", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.chat_driver:
+        chat_driver(args.queries, args.chat_folder, args.seed)
+        return
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    work = args.work or Path(tempfile.mkdtemp(prefix="pkm_bench_"))
+    work.mkdir(parents=True, exist_ok=True)
+    export_dir, vault_dir = work / "export", work / "vault"
+
+    print(f"🧪 Generating synthetic data in {work}...")
+    generate_export(export_dir, args.conversations, args.turns, args.seed)
+    generate_vault(vault_dir / "Imported_Notes", args.notes, args.seed)
+    duplicate_notes(vault_dir / "Imported_Notes", args.dup_fraction, args.seed + 2)
+
+    server = start_stand_in(args.latency)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    (work / ".streamlit").mkdir(exist_ok=True)
+    (work / ".streamlit" / "secrets.toml").write_text(
+        f'SUPABASE_URL = "{url}"\nSUPABASE_KEY = "{FAKE_KEY}"\nOPENAI_API_KEY = "{FAKE_KEY}"\n',
+        encoding="utf-8",
+    )
+    env = dict(
+        os.environ,
+        SUPABASE_URL=url,
+        SUPABASE_SERVICE_KEY=FAKE_KEY,
+        OPENAI_API_KEY=FAKE_KEY,
+        OPENAI_BASE_URL=f"{url}/v1",
+        OPENAI_API_BASE=f"{url}/v1",
+        CHATGPT_EXPORT_DIR=str(export_dir),
+        CHATGPT_EXPORT_LOG=str(work / "chatgpt_export_log.txt"),
+        VAULT_DIR=str(vault_dir),
+        DOCS_DIR=str(vault_dir),
+        VECTOR_STORE=args.store,
+        LOCAL_STORE_DIR=str(work / "local_store"),
+        DEDUP_DIR=str(work / "dedup"),
+        PYTHONIOENCODING="utf-8",
+    )
+
+    results = []
+    n_notes = lambda: len(list(vault_dir.rglob("*.md")))
+    try:
+        for stage in stages:
+            print(f"▶️ {stage}...")
+            if stage == "convert":
+                result = run_stage(stage, SCRIPTS_DIR / "chatgpt_export_to_markdown.py", [], env, work,
+                                   args.conversations, "conversations")
+            elif stage == "ingest":
+                result = run_stage(stage, SCRIPTS_DIR / "ingest_md_to_supabase_v2.py", [], env, work,
+                                   n_notes(), "files")
+            elif stage == "docs":
+                result = run_stage(stage, SCRIPTS_DIR / "ingest_docs.py", [], env, work,
+                                   n_notes(), "files")
+            elif stage == "watch":
+                touch_notes(vault_dir, args.edit_fraction, args.seed + 1)
+                result = run_stage(stage, SCRIPTS_DIR / "ingest_watch.py", ["--once"], env, work,
+                                   n_notes(), "files")
+            elif stage == "chat":
+                result = run_stage(stage, Path(__file__),
+                                   ["--chat-driver", "--queries", str(args.queries), "--chat-folder", args.chat_folder],
+                                   env, work, args.queries, "queries")
+                driver = [json.loads(line)
+                          for line in Path(result["log"]).read_text(encoding="utf-8").splitlines()
+                          if line.startswith('{"latencies_s"')]
+                if driver:
+                    result["latency_s"] = {}
+                    for kind, values in driver[0]["latencies_s"].items():
+                        if not values:
+                            continue
+                        ordered = sorted(values)
+                        result["latency_s"][kind] = {
+                            "p50": round(ordered[len(ordered) // 2], 4),
+                            "p90": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))], 4),
+                            "max": round(ordered[-1], 4),
+                        }
+                    result["filtered_sources"] = driver[0]["filtered_sources"]
+                    result["filter_violations"] = driver[0]["filter_violations"]
+                    if result["filter_violations"]:
+                        result["ok"] = False
+            else:
+                print(f"⚠️ Unknown stage: {stage}")
+                continue
+            status = "✅" if result["ok"] else f"❌ (see {result['log']})"
+            print(f"   {status} {result['wall_s']:.2f}s, {result['throughput_per_s']} {result['unit']}/s, "
+                  f"peak {result['peak_rss_mb']} MB")
+            results.append(result)
+    finally:
+        server.shutdown()
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("work", "out", "chat_driver")},
+        "stored_rows": {t: len(rows) for t, rows in StandInHandler.tables.items()},
+        "stages": results,
+    }
+    deltas = compare_with_previous(args.out, run)
+    with open(args.out, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+    print(f"📜 Results appended to {args.out}")
+    if deltas:
+        print("📈 Change vs previous run with the same parameters:")
+        print("\n".join(deltas))
+
+    # Keep the scratch dir (and stage logs) around when something failed
+    if not args.work and all(r["ok"] for r in results):
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
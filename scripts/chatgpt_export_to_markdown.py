@@ -4,12 +4,14 @@ import re
 from datetime import datetime
 from pathlib import Path
 
-# Configuration
-BASE_INPUT = Path(r"C:\AI_SecondBrain\exports\temp_extract")
+from conversation_turns import write_turns, iso_timestamp
+
+# Configuration (paths can be overridden via environment, e.g. by bench_pipeline.py)
+BASE_INPUT = Path(os.getenv("CHATGPT_EXPORT_DIR", r"C:\AI_SecondBrain\exports\temp_extract"))
 INPUT_JSON = BASE_INPUT / "conversations.json"
 CHUNKS_DIR = BASE_INPUT / "splits"
-OUTPUT_ROOT = Path(r"C:\AI_SecondBrain\local-ai-packaged\data\personal_vault")
-LOG_FILE = Path(r"C:\AI_SecondBrain\scripts\chatgpt_export_log.txt")
+OUTPUT_ROOT = Path(os.getenv("VAULT_DIR", r"C:\AI_SecondBrain\local-ai-packaged\data\personal_vault"))
+LOG_FILE = Path(os.getenv("CHATGPT_EXPORT_LOG", r"C:\AI_SecondBrain\scripts\chatgpt_export_log.txt"))
 
 # Folder mapping based on keywords
 FOLDER_MAP = {
@@ -43,7 +45,15 @@ def extract_content(content):
     if isinstance(content, str):
         return content.strip()
     if isinstance(content, dict):
+        # Export messages look like {"content_type": "text", "parts": [...]}; read the body first
+        for key in ("parts", "text", "result"):
+            if key in content:
+                result = extract_content(content[key])
+                if result:
+                    return result
         for key in content:
+            if key == "content_type":
+                continue
             result = extract_content(content[key])
             if result:
                 return result
@@ -52,41 +62,47 @@ def extract_content(content):
     return ""
 
 def get_folder(title):
-    """Assign folder based on title keywords."""
+    """Assign folder based on title keywords (whole words, so "repair" is not "ai")."""
     title_lower = title.lower()
     for pattern, folder in FOLDER_MAP.items():
-        if re.search(pattern, title_lower):
+        if re.search(rf"\b({pattern})\b", title_lower):
             return folder
     return DEFAULT_FOLDER
 
 def process_conversation(conv, conv_index):
-    """Process a single conversation and save to Markdown."""
+    """Process a single conversation and save to Markdown plus per-turn records."""
     global replies_saved, replies_skipped
     title = conv.get("title", "Conversation")
     prompt = title
+    conv_id = conv.get("id") or conv.get("conversation_id") or f"conv-{conv_index}"
 
-    # Find user prompt for title
     messages = conv.get("messages", []) or [
         m.get("message", {}) for m in conv.get("mapping", {}).values() if m.get("message")
     ]
-    for msg in messages:
-        if isinstance(msg, dict):
-            role = msg.get("role") or msg.get("author", {}).get("role")
-            if role == "user":
-                content = msg.get("content", "")
-                prompt = extract_content(content)[:50]
-                break
 
-    # Extract assistant messages
-    assistant_texts = []
+    # Collect user/assistant turns in chronological order
+    turns = []
     for msg in messages:
         if isinstance(msg, dict):
             role = msg.get("role") or msg.get("author", {}).get("role")
-            if role == "assistant":
-                content = msg.get("content", "")
-                text = extract_content(content)
-                if text:
-                    assistant_texts.append(text)
+            if role not in ("user", "assistant"):
+                continue
+            text = extract_content(msg.get("content", ""))
+            if text:
+                turns.append({
+                    "role": role,
+                    "text": text,
+                    "created_at": msg.get("create_time") or conv.get("create_time"),
+                })
+    turns.sort(key=lambda t: t["created_at"] or 0)
+
+    # First user prompt becomes the title
+    for turn in turns:
+        if turn["role"] == "user":
+            prompt = turn["text"][:50]
+            break
+
+    assistant_texts = [t["text"] for t in turns if t["role"] == "assistant"]
 
     if not assistant_texts:
         log_message(f"⚠️ Skipped (no assistant replies): {title}")
@@ -94,15 +110,32 @@ def process_conversation(conv, conv_index):
         replies_skipped += 1
         return 0
 
-    # Save to Markdown
     folder = get_folder(title)
     filename = f"{sanitize_filename(prompt)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{conv_index}.md"
     filepath = folder / filename
+
+    # Save structured turns first: a watcher that sees the .md must already find
+    # them, or it would store the whole file and then every turn again
+    topic = folder.relative_to(OUTPUT_ROOT).as_posix()
+    write_turns(filepath, [
+        {
+            "conversation_id": conv_id,
+            "title": title,
+            "turn_index": i,
+            "role": turn["role"],
+            "created_at": iso_timestamp(turn["created_at"]),
+            "folder": topic,
+            "text": turn["text"],
+        }
+        for i, turn in enumerate(turns)
+    ])
+
+    # Save to Markdown
     with open(filepath, "w", encoding="utf-8") as f:
         f.write(f"# {prompt}\n\n")
         f.write("\n\n".join(assistant_texts) + "\n")
 
-    log_message(f"✅ Saved {len(assistant_texts)} replies to {filepath}")
+    log_message(f"✅ Saved {len(assistant_texts)} replies ({len(turns)} turns) to {filepath}")
     return len(assistant_texts)
 
 def main():
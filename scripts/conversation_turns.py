@@ -0,0 +1,65 @@
+import os
+import json
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+# Per-turn records live next to the markdown: Foo_123.md -> Foo_123.turns.jsonl
+TURNS_SUFFIX = ".turns.jsonl"
+TURN_FIELDS = ("conversation_id", "title", "turn_index", "role", "created_at", "folder")
+
+
+def iso_timestamp(ts: Optional[float]) -> Optional[str]:
+    """Epoch seconds -> ISO 8601 UTC string (sorts correctly as text)."""
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(float(ts), timezone.utc).isoformat(timespec="seconds")
+
+
+def turns_path(md_path: Path) -> Path:
+    md_path = Path(md_path)
+    return md_path.with_name(md_path.stem + TURNS_SUFFIX)
+
+
+def write_turns(md_path: Path, turns: List[Dict[str, Any]]):
+    """Write the turn records atomically so a watcher never reads a partial file."""
+    path = turns_path(md_path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for turn in turns:
+            f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+def load_turns(md_path: Path) -> Optional[List[Dict[str, Any]]]:
+    """Return the turn records for a converted conversation, or None for plain notes."""
+    path = turns_path(md_path)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def turn_metadata(turn: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields stored as filterable chunk metadata."""
+    return {k: turn[k] for k in TURN_FIELDS if turn.get(k) is not None}
+
+
+def file_url(file_path: Path) -> str:
+    """The url every ingester stores for a vault file, so their rows and dedup entries line up."""
+    return "file://" + Path(file_path).absolute().as_posix()
+
+
+def file_metadata(file_path: Path, root: Optional[Path] = None) -> Dict[str, Any]:
+    """Folder (relative to the vault root) and modification time for a plain note."""
+    file_path = Path(file_path)
+    folder = file_path.parent
+    if root is not None:
+        try:
+            folder = folder.relative_to(root)
+        except ValueError:
+            pass
+    return {
+        "folder": folder.as_posix() if str(folder) != "." else "",
+        "created_at": iso_timestamp(file_path.stat().st_mtime),
+    }
@@ -0,0 +1,348 @@
+import os
+import re
+import hashlib
+import logging
+from pathlib import Path
+from typing import List, Dict, Optional, NamedTuple
+
+import numpy as np
+
+from instrumentation import count
+from vector_store import VectorStore, LocalVectorStore, SupabaseStore, file_lock
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DEDUP_ENABLED = os.getenv("DEDUP", "1") != "0"
+DEDUP_DIR = Path(os.getenv("DEDUP_DIR", Path(__file__).parent.parent / "local_store" / "dedup"))  # non-local stores
+NUM_PERM = 64                 # MinHash signature length
+BANDS = 16                    # LSH bands (NUM_PERM / BANDS rows each)
+SHINGLE_WORDS = 3
+JACCARD_THRESHOLD = 0.8       # estimated shingle overlap that counts as near-duplicate
+EMBED_THRESHOLD = 0.97        # cosine similarity that counts as near-duplicate
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MASK = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(1)   # fixed so signatures stay comparable across runs
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i+size]) for i in range(len(words) - size + 1)}
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def index_path(name: str, store: Optional[VectorStore] = None) -> Path:
+    """
+    One index per store and table, shared by every ingester that writes to
+    it: beside the data for a local store, under DEDUP_DIR for Supabase.
+    `name` only picks the file when no store is given.
+    """
+    if isinstance(store, LocalVectorStore):
+        return store.root / "dedup.npz"
+    if isinstance(store, SupabaseStore):
+        return DEDUP_DIR / f"supabase_{store.table}.npz"
+    return DEDUP_DIR / f"{name}.npz"
+
+
+def read_index(path: Path) -> Dict[str, np.ndarray]:
+    data = np.load(path, allow_pickle=False)
+    index = {k: data[k] for k in data.files}
+    # Indexes saved before positions/hashes were tracked: an unknown hash re-ingests once
+    for key in ("positions", "hashes"):
+        if key not in index:
+            index[key] = np.full(len(index["ids"]), "", dtype=str)
+    return index
+
+
+def minhash(text: str) -> np.ndarray:
+    """NUM_PERM-long MinHash signature over word shingles."""
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles(text)),
+        dtype=np.uint64,
+    )
+    # Universal hashing (a*x + b) mod p, one row per permutation; uint64 wraparound is fine here
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME & _MASK
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+KEPT = ("keep", "merge")   # actions whose chunk gets embedded and upserted
+
+
+class Decision(NamedTuple):
+    action: str                 # "keep", "merge", "skip" (near-duplicate) or "unchanged"
+    match_id: Optional[str]     # id of the existing near-duplicate, if any
+    entry: int                  # index slot in the Deduplicator
+
+
+class Deduplicator:
+    """
+    Two-step near-duplicate filter backed by a local index file per store.
+
+    screen_text() runs before embedding (MinHash + LSH over shingles);
+    screen_embedding() runs before upsert (cosine against LSH candidates).
+    A chunk whose id is already indexed is "unchanged" if its content is
+    identical and "merge" otherwise, so the caller overwrites that row.
+    A near-duplicate from the same url and position is also "merge" when
+    merge_same_source is set; any other near-duplicate is "skip".
+
+    Several ingesters (and processes) share one index: save() merges with
+    whatever is on disk under a lock file and picks up the others' entries.
+    """
+
+    def __init__(self, name: str, store: Optional[VectorStore] = None, merge_same_source: bool = False,
+                 jaccard_threshold: float = JACCARD_THRESHOLD,
+                 embed_threshold: float = EMBED_THRESHOLD, enabled: bool = DEDUP_ENABLED):
+        self.name = name
+        self.path = index_path(name, store)
+        self.store = store
+        self.merge_same_source = merge_same_source
+        self.jaccard_threshold = jaccard_threshold
+        self.embed_threshold = embed_threshold
+        self.enabled = enabled
+
+        # Arrays grow by doubling; only the first len(self.ids) rows are in use
+        self.ids: List[str] = []
+        self.urls: List[str] = []
+        self.positions: List[str] = []
+        self.hashes: List[str] = []
+        self.entries: Dict[str, int] = {}   # id -> slot of its live entry
+        self.alive = np.zeros(0, dtype=bool)
+        self.sigs = np.zeros((0, NUM_PERM), dtype=np.uint32)
+        self.embs: Optional[np.ndarray] = None
+        self.has_emb = np.zeros(0, dtype=bool)
+        self.buckets: Dict[tuple, List[int]] = {}
+        # Bookkeeping for merging with other writers in save()
+        self._touched: set = set()    # ids added or changed since the last load/save
+        self._removed: set = set()    # ids forgotten or discarded since then
+        self.stats = {"seen": 0, "unchanged": 0, "skipped": 0, "merged": 0, "chars_removed": 0}
+        if enabled:
+            self._load()
+
+    # -- index -----------------------------------------------------------
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        if self.store is not None and self.store.count() == 0:
+            # The store was wiped or recreated; its old index would skip everything
+            logger.info(f"Store is empty, rebuilding dedup index {self.path}")
+            return
+        self._adopt(read_index(self.path))
+        logger.info(f"Loaded dedup index {self.path} ({len(self.ids)} entries)")
+
+    def _adopt(self, index: Dict[str, np.ndarray]):
+        """Replace the in-memory index with `index` (arrays as written by save())."""
+        self.ids = index["ids"].tolist()
+        self.urls = index["urls"].tolist()
+        self.positions = index["positions"].tolist()
+        self.hashes = index["hashes"].tolist()
+        self.entries = {cid: i for i, cid in enumerate(self.ids)}
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.sigs = index["sigs"].astype(np.uint32)
+        self.has_emb = index["has_emb"].astype(bool)
+        self.embs = index["embs"].astype(np.float32) if index["embs"].size else None
+        self.buckets = {}
+        for i, sig in enumerate(self.sigs):
+            self._bucket(i, sig)
+        self._touched, self._removed = set(), set()
+
+    def _snapshot(self, entries: np.ndarray) -> Dict[str, np.ndarray]:
+        return {
+            "ids": np.array([self.ids[i] for i in entries], dtype=str),
+            "urls": np.array([self.urls[i] for i in entries], dtype=str),
+            "positions": np.array([self.positions[i] for i in entries], dtype=str),
+            "hashes": np.array([self.hashes[i] for i in entries], dtype=str),
+            "sigs": self.sigs[entries],
+            "has_emb": self.has_emb[entries],
+            "embs": self.embs[entries] if self.embs is not None else np.zeros((0, 0), dtype=np.float32),
+        }
+
+    def _merge(self, disk: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Our live entries plus the entries other writers added since we last synced."""
+        disk_ids = set(disk["ids"].tolist())
+        # An untouched entry missing from disk was removed by another writer
+        mine = np.array([i for i in np.flatnonzero(self.alive[:len(self.ids)])
+                         if self.ids[i] in self._touched or self.ids[i] in disk_ids], dtype=int)
+        known = {self.ids[i] for i in mine} | self._removed
+        theirs = np.array([j for j, cid in enumerate(disk["ids"].tolist()) if cid not in known], dtype=int)
+        ours = self._snapshot(mine)
+        merged = {k: np.concatenate([ours[k], disk[k][theirs]]) for k in ours if k != "embs"}
+
+        ours_embs, disk_embs = ours["embs"], disk["embs"]
+        if not disk_embs.size or (ours_embs.size and ours_embs.shape[1] != disk_embs.shape[1]):
+            # Their embeddings are missing or from another model: keep only ours
+            dim = ours_embs.shape[1] if ours_embs.size else 0
+            disk_embs = np.zeros((len(disk["ids"]), dim), dtype=np.float32)
+            merged["has_emb"][len(mine):] = False
+        if not ours_embs.size:
+            ours_embs = np.zeros((len(mine), disk_embs.shape[1]), dtype=np.float32)
+            merged["has_emb"][:len(mine)] = False
+        merged["embs"] = np.concatenate([ours_embs, disk_embs[theirs]])
+        return merged
+
+    def save(self):
+        """Merge into the on-disk index and reload it; earlier Decisions are stale afterwards."""
+        if not self.enabled:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.path.with_suffix(".lock")):
+            if self.path.exists():
+                index = self._merge(read_index(self.path))
+            else:
+                index = self._snapshot(np.flatnonzero(self.alive[:len(self.ids)]))
+            tmp = self.path.with_suffix(".tmp.npz")
+            np.savez(tmp, **index)
+            os.replace(tmp, self.path)
+        self._adopt(index)
+
+    def _bucket(self, entry: int, sig: np.ndarray):
+        rows = NUM_PERM // BANDS
+        for band in range(BANDS):
+            key = (band, sig[band * rows:(band + 1) * rows].tobytes())
+            self.buckets.setdefault(key, []).append(entry)
+
+    def _candidates(self, sig: np.ndarray) -> set:
+        rows = NUM_PERM // BANDS
+        found = set()
+        for band in range(BANDS):
+            found.update(self.buckets.get((band, sig[band * rows:(band + 1) * rows].tobytes()), ()))
+        return {c for c in found if self.alive[c]}
+
+    def _grow(self):
+        def grown(arr):
+            out = np.zeros((max(2 * len(arr), 64),) + arr.shape[1:], dtype=arr.dtype)
+            out[:len(arr)] = arr
+            return out
+        self.alive = grown(self.alive)
+        self.sigs = grown(self.sigs)
+        self.has_emb = grown(self.has_emb)
+        if self.embs is not None:
+            self.embs = grown(self.embs)
+
+    def _add(self, chunk_id: str, url: str, position: str, digest: str, sig: np.ndarray) -> int:
+        entry = len(self.ids)
+        if entry >= len(self.sigs):
+            self._grow()
+        self._touched.add(chunk_id)
+        self.ids.append(chunk_id)
+        self.urls.append(url)
+        self.positions.append(position)
+        self.hashes.append(digest)
+        self.entries[chunk_id] = entry
+        self.alive[entry] = True
+        self.sigs[entry] = sig
+        self.has_emb[entry] = False
+        self._bucket(entry, sig)
+        return entry
+
+    def _replace(self, entry: int, digest: str, sig: np.ndarray):
+        self._touched.add(self.ids[entry])
+        self.hashes[entry] = digest
+        self.sigs[entry] = sig
+        self._bucket(entry, sig)   # stale buckets only cost a rejected candidate
+
+    # -- screening -------------------------------------------------------
+
+    def screen_text(self, text: str, url: str, chunk_id: str, position: str = "") -> Decision:
+        """
+        Check a chunk before embedding; registers it as kept if it is new.
+        `position` (e.g. turn or chunk index) limits same-source merges to
+        the chunk the text replaces.
+        """
+        if not self.enabled:
+            return Decision("keep", None, -1)
+        self.stats["seen"] += 1
+        digest = content_hash(text)
+        sig = minhash(text)
+
+        same = self.entries.get(chunk_id)
+        if same is not None and self.alive[same]:
+            if self.hashes[same] == digest:
+                self.stats["unchanged"] += 1   # a re-ingest, not a near-duplicate removal
+                count("dedup_unchanged")
+                return Decision("unchanged", chunk_id, same)
+            self._replace(same, digest, sig)
+            return self._record(Decision("merge", chunk_id, same), text)     # edited: overwrite the row
+
+        best, best_score = None, 0.0
+        for cand in self._candidates(sig):
+            score = float(np.mean(self.sigs[cand] == sig))
+            if score > best_score:
+                best, best_score = cand, score
+        if best is not None and best_score >= self.jaccard_threshold:
+            same_chunk = self.urls[best] == url and self.positions[best] == position
+            if self.merge_same_source and same_chunk and self.hashes[best] != digest:
+                self._replace(best, digest, sig)
+                return self._record(Decision("merge", self.ids[best], best), text)
+            return self._record(Decision("skip", self.ids[best], best), text)
+        return Decision("keep", None, self._add(chunk_id, url, position, digest, sig))
+
+    def screen_embedding(self, decision: Decision, embedding: List[float], text: str = "") -> Decision:
+        """Check a kept chunk's embedding against the index before upsert."""
+        if not self.enabled or decision.action not in KEPT:
+            return decision
+        vec = np.asarray(embedding, dtype=np.float32)
+        vec = vec / (np.linalg.norm(vec) or 1)
+        if self.embs is None or self.embs.shape[1] != vec.shape[0]:
+            # First embedding, or the model changed: start the embedding index over
+            self.embs = np.zeros((len(self.sigs), vec.shape[0]), dtype=np.float32)
+            self.has_emb[:] = False
+
+        if decision.action == "keep":
+            # Only chunks sharing an LSH band with this one, not the whole index
+            candidates = np.array([c for c in self._candidates(self.sigs[decision.entry])
+                                   if c != decision.entry and self.has_emb[c]], dtype=int)
+            if len(candidates):
+                scores = self.embs[candidates] @ vec
+                top = int(np.argmax(scores))
+                if scores[top] >= self.embed_threshold:
+                    self.forget(decision)
+                    match = int(candidates[top])
+                    return self._record(Decision("skip", self.ids[match], match), text)
+        self.embs[decision.entry] = vec
+        self.has_emb[decision.entry] = True
+        return decision
+
+    def forget(self, decision: Decision):
+        """Undo a keep or merge whose row never made it into the store (e.g. upsert failed)."""
+        if not self.enabled:
+            return
+        if decision.action == "keep":
+            self.alive[decision.entry] = False
+            self.entries.pop(self.ids[decision.entry], None)
+            self._removed.add(self.ids[decision.entry])
+            self._touched.discard(self.ids[decision.entry])
+        elif decision.action == "merge":
+            self.hashes[decision.entry] = ""   # the stored row is stale; re-ingest it next time
+
+    def discard(self, ids: List[str]):
+        """Drop entries whose rows were deleted from the store."""
+        for cid in ids:
+            entry = self.entries.pop(cid, None)
+            if entry is not None:
+                self.alive[entry] = False
+            self._removed.add(cid)
+            self._touched.discard(cid)
+
+    def _record(self, decision: Decision, text: str) -> Decision:
+        key = "skipped" if decision.action == "skip" else "merged"
+        self.stats[key] += 1
+        self.stats["chars_removed"] += len(text) if decision.action == "skip" else 0
+        count(f"dedup_{key}")
+        return decision
+
+    def report(self) -> str:
+        screened = self.stats["seen"] - self.stats["unchanged"]
+        return (
+            f"🧹 Dedup ({self.name}): skipped {self.stats['skipped']}/{screened} new or changed chunks "
+            f"({self.stats['skipped'] / (screened or 1):.1%}, {self.stats['chars_removed']:,} chars), "
+            f"merged {self.stats['merged']}, unchanged {self.stats['unchanged']}"
+        )
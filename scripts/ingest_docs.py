@@ -6,20 +6,28 @@ from supabase import create_client
 import openai
 from tqdm import tqdm
 
+from vector_store import STORE_BACKEND, get_store
+from instrumentation import metrics, timer, count
+from dedup import Deduplicator, KEPT
+
 load_dotenv()  # pulls keys from .env
 
-DATA_DIR = Path(r"C:\AI_SecondBrain\UltimateAI\data\docs")
+DATA_DIR = Path(os.getenv("DOCS_DIR", r"C:\AI_SecondBrain\UltimateAI\data\docs"))
 BATCH_SIZE = 20            # tune if you hit rate limits
 MODEL = "text-embedding-ada-002"
 
 supabase = create_client(os.environ["SUPABASE_URL"],
-                         os.environ["SUPABASE_SERVICE_KEY"])
-openai.api_key = os.environ["OPENAI_API_KEY"]
+                         os.environ["SUPABASE_SERVICE_KEY"]) if STORE_BACKEND == "supabase" else None
+store = get_store(supabase, table="documents", url_field="metadata->>path")
+client = openai.OpenAI(api_key=os.environ["OPENAI_API_KEY"])   # honours OPENAI_BASE_URL
+dedup = Deduplicator("documents", store)
 
 def embed_batch(texts):
     """Call OpenAI embeddings in batches to respect rate limits."""
-    resp = openai.Embedding.create(model=MODEL, input=texts)
-    return [d["embedding"] for d in resp["data"]]
+    with timer("embed"):
+        resp = client.embeddings.create(model=MODEL, input=texts)
+    count("embedded_chunks", len(texts))
+    return [d.embedding for d in resp.data]
 
 # gather markdown files
 files = list(DATA_DIR.rglob("*.md"))
@@ -27,17 +35,42 @@ print(f"Found {len(files)} markdown files")
 
 for i in tqdm(range(0, len(files), BATCH_SIZE), desc="Embedding"):
     batch_files = files[i:i+BATCH_SIZE]
-    batch_texts = [f.read_text(encoding="utf-8")[:8000] for f in batch_files]
-    embeddings = embed_batch(batch_texts)
-
-    rows = []
-    for f, emb in zip(batch_files, embeddings):
-        rows.append({
-            "content": f.read_text(encoding="utf-8"),
-            "metadata": {"path": str(f)},
-            "embedding": emb,
-        })
-    supabase.table("documents").insert(rows).execute()
-    time.sleep(1)   # gentle pause to avoid bursts
+    with timer("read"):
+        batch_contents = [f.read_text(encoding="utf-8") for f in batch_files]
+
+    # Skip near-duplicate documents before paying for their embeddings
+    with timer("dedup"):
+        decisions = [dedup.screen_text(content, str(f), str(f)) for f, content in zip(batch_files, batch_contents)]
+        kept = [j for j, d in enumerate(decisions) if d.action in KEPT]
+    if not kept:
+        continue
+    embeddings = embed_batch([batch_contents[j][:8000] for j in kept])
+
+    with timer("serialize"):
+        rows, edited = [], []
+        for j, emb in zip(kept, embeddings):
+            f, content = batch_files[j], batch_contents[j]
+            if dedup.screen_embedding(decisions[j], emb, content).action not in KEPT:
+                continue
+            if decisions[j].action == "merge":
+                edited.append(str(f))
+            rows.append({
+                "content": content,
+                "metadata": {"path": str(f)},
+                "embedding": emb,
+            })
+    with timer("upsert"):
+        for path in edited:
+            store.delete_url(path)   # rows have no stable id, so drop the old version first
+        store.upsert(rows)
+    count("files", len(rows))
+    # Rows have no stable id, so a re-insert would duplicate them: record each stored batch
+    # right away in case a later one fails (e.g. on the rate limit)
+    dedup.save()
+    if STORE_BACKEND == "supabase":
+        time.sleep(1)   # gentle pause to avoid bursts
 
 print("✅ All documents ingested.")
+print(dedup.report())
+print(metrics.report())
+print(f"📊 Metrics written to {metrics.export()}")
@@ -1,5 +1,6 @@
 import os
 import asyncio
+import hashlib
 from pathlib import Path
 from typing import List, Dict, Any
 
@@ -9,11 +10,16 @@ from sentence_transformers import SentenceTransformer
 from supabase import create_client, Client
 import numpy as np
 
+from vector_store import STORE_BACKEND, get_store
+from instrumentation import metrics, timer, count
+from conversation_turns import load_turns, turn_metadata, file_metadata, file_url
+from dedup import Deduplicator, KEPT
+
 # Load .env variables
 load_dotenv()
 
 # Constants
-DATA_DIR = Path(__file__).parent.parent / "personal_vault"
+DATA_DIR = Path(os.getenv("VAULT_DIR", Path(__file__).parent.parent / "personal_vault"))
 CHUNK_TOKEN_SIZE = 500
 BATCH_SIZE = 50
 
@@ -22,8 +28,13 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if STORE_BACKEND == "supabase" else None
+store = get_store(supabase)
+
 
+dedup = Deduplicator("personal_vault", store)
+# url -> ids of the rows the current version of that file uses; the rest are stale
+file_rows: Dict[str, set] = {}
 
 tokenizer = tiktoken.get_encoding("cl100k_base")
 print(f"Loading embedding model: {EMBEDDING_MODEL}...")
@@ -32,12 +43,15 @@ print(f"Embedding model loaded. Dimension: {embedding_model.get_sentence_embeddi
 
 def chunk_text(text: str, max_tokens: int = CHUNK_TOKEN_SIZE) -> List[str]:
     words = text.split()
+    with timer("tokenize"):
+        token_counts = [len(ids) for ids in tokenizer.encode_batch(words)] if words else []
+    count("tokens", sum(token_counts))
+
     chunks = []
     current_chunk = []
     current_tokens = 0
 
-    for word in words:
-        word_tokens = len(tokenizer.encode(word))
+    for word, word_tokens in zip(words, token_counts):
         if current_tokens + word_tokens > max_tokens:
             chunks.append(" ".join(current_chunk))
             current_chunk = [word]
@@ -58,7 +72,9 @@ def embed_texts(texts: List[str]) -> List[List[float]]:
 
 
     try:
-        embeddings = embedding_model.encode(texts, convert_to_numpy=True)
+        with timer("embed"):
+            embeddings = embedding_model.encode(texts, convert_to_numpy=True)
+        count("embedded_chunks", len(texts))
         return embeddings.tolist()
     except Exception as e:
         return {
@@ -70,34 +86,72 @@ def process_file(file_path: Path) -> List[Dict[str, Any]]:
 
 
 
+    decisions = []
     try:
-        text = file_path.read_text(encoding="utf-8")
-        chunks = chunk_text(text, max_tokens=CHUNK_TOKEN_SIZE)
-        embeddings = embed_texts(chunks)
-
-
-
-
-
-
-
-
-
-
-
-
-        records = []
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            records.append({
-                "url": str(file_path),
-                "content": chunk,
-                "summary": chunk[:100],
-                "source": "personal_vault",
-                "embedding": embedding,
-                "file_name": file_path.name
-            })
+        with timer("read"):
+            turns = load_turns(file_path)
+            text = None if turns else file_path.read_text(encoding="utf-8")
+        with timer("chunk"):
+            if turns:
+                # Converted conversation: chunk each turn on its own, keep its metadata
+                chunks, metas = [], []
+                for turn in turns:
+                    for piece in chunk_text(turn["text"], max_tokens=CHUNK_TOKEN_SIZE):
+                        chunks.append(piece)
+                        metas.append(turn_metadata(turn))
+            else:
+                chunks = chunk_text(text, max_tokens=CHUNK_TOKEN_SIZE)
+                metas = [file_metadata(file_path, DATA_DIR)] * len(chunks)
+
+        # Drop near-duplicate chunks before paying for their embeddings; ids are
+        # positional so an edited chunk overwrites its own row
+        url = file_url(file_path)
+        ids = [hashlib.md5(f"{url}#{i}".encode()).hexdigest() for i in range(len(chunks))]
+        with timer("dedup"):
+            decisions = [dedup.screen_text(chunk, url, ids[i])
+                         for i, chunk in enumerate(chunks)]
+            kept = [i for i, d in enumerate(decisions) if d.action in KEPT]
+        current = file_rows[url] = set(ids) | {d.match_id for d in decisions if d.match_id}
+        if not kept:
+            return []
+        embeddings = embed_texts([chunks[i] for i in kept])
+        if isinstance(embeddings, dict):
+            raise RuntimeError(embeddings["tool_result"]["error"])
+
+
+
+
+
+
+
+
+
+
+
+
+        with timer("serialize"):
+            records = []
+            for i, embedding in zip(kept, embeddings):
+                decision = dedup.screen_embedding(decisions[i], embedding, chunks[i])
+                if decision.action not in KEPT:
+                    current.add(decision.match_id)
+                    continue
+                records.append({
+                    "id": ids[i],
+                    "url": url,
+                    "content": chunks[i],
+                    "summary": chunks[i][:100],
+                    "source": "personal_vault",
+                    "embedding": embedding,
+                    "file_name": file_path.name,
+                    "metadata": dict(metas[i], chunk_index=i)
+                })
         return records
     except Exception as e:
+        # None of this file's chunks reach the store; don't let the index claim them
+        for d in decisions:
+            dedup.forget(d)
+        file_rows.pop(file_url(file_path), None)
         return {
             "tool_result": {"error": f"File processing failed: {str(e)}"},
             "tool_id": "process_file"
@@ -108,14 +162,19 @@ def process_file(file_path: Path) -> List[Dict[str, Any]]:
 
 
 
-def upsert_records(records: List[Dict[str, Any]]):
+def upsert_records(records: List[Dict[str, Any]]) -> int:
+    failed = 0
     for i in range(0, len(records), BATCH_SIZE):
         batch = records[i:i+BATCH_SIZE]
         try:
-            response = supabase.table("crawled_pages").upsert(batch).execute()
+            with timer("upsert"):
+                store.upsert(batch)
+            count("upserted_rows", len(batch))
             print(f"✅ Upserted batch {i//BATCH_SIZE + 1}/{(len(records) + BATCH_SIZE - 1)//BATCH_SIZE}")
         except Exception as e:
             print(f"❌ Failed to upsert batch starting at {i}: {e}")
+            failed += 1
+    return failed
 
 
 
@@ -160,17 +219,37 @@ def main():
         print(f"\n📄 Processing file {i}/{len(md_files)}: {file_path.name}")
         try:
             records = process_file(file_path)
+            if isinstance(records, dict):
+                raise RuntimeError(records["tool_result"]["error"])
             all_records.extend(records)
+            count("files")
             print(f"   ✅ Generated {len(records)} chunks")
         except Exception as e:
             print(f"   ⚠️ Error processing {file_path}: {e}")
 
     print(f"\n📦 Total chunks to upsert: {len(all_records)}")
+    print(dedup.report())
+    failed = 0
     if all_records:
-        upsert_records(all_records)
+        failed = upsert_records(all_records)
         print("✅ Ingestion completed successfully!")
     else:
         print("❌ No records to upsert.")
 
+    # Only remember chunks as seen (and drop superseded rows) once they are actually stored
+    if failed:
+        print(f"⚠️ {failed} batch(es) failed; dedup index not updated so they are retried next run")
+    else:
+        with timer("delete"):
+            stale = [cid for url, keep in file_rows.items() for cid in store.delete_url(url, keep=keep)]
+        dedup.discard(stale)
+        if stale:
+            count("stale_rows", len(stale))
+            print(f"🗑️ Removed {len(stale)} row(s) no longer in their file")
+        dedup.save()
+
+    print(metrics.report())
+    print(f"📊 Metrics written to {metrics.export()}")
+
 if __name__ == "__main__":
     main()
@@ -9,10 +9,18 @@ from supabase import create_client
 import argparse
 from datetime import datetime
 import hashlib
+import threading
+
+from vector_store import STORE_BACKEND, get_store
+from instrumentation import metrics, timer, count
+from conversation_turns import TURNS_SUFFIX, load_turns, turn_metadata, file_metadata, file_url
+from dedup import Deduplicator, KEPT
 
 # Load environment from streamlit secrets
 import streamlit as st
 
+METRICS_EXPORT_INTERVAL = 60  # seconds between metrics file refreshes in daemon mode
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,56 +32,127 @@ logging.basicConfig(
 )
 
 class DocumentHandler(FileSystemEventHandler):
-    def __init__(self):
+    def __init__(self, root=None):
+        self.root = root
         self.supabase = create_client(
             st.secrets["SUPABASE_URL"], 
             st.secrets["SUPABASE_KEY"]
-        )
+        ) if STORE_BACKEND == "supabase" else None
+        self.store = get_store(self.supabase)
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Small edits to a file (or one turn of it) overwrite that chunk's row instead of adding one
+        self.dedup = Deduplicator('local_file', self.store, merge_same_source=True)
+        self.lock = threading.Lock()   # watchdog thread vs. periodic index saves
         
     def on_modified(self, event):
-        if not event.is_directory and event.src_path.endswith(('.md', '.txt', '.pdf')):
-            self.process_file(event.src_path)
+        self._dispatch(event)
             
     def on_created(self, event):
-        if not event.is_directory and event.src_path.endswith(('.md', '.txt', '.pdf')):
-            self.process_file(event.src_path)
+        self._dispatch(event)
+
+    def on_moved(self, event):
+        # Turn records are written to a temp file and renamed into place
+        self._dispatch(event, event.dest_path)
+
+    def _dispatch(self, event, path=None):
+        if event.is_directory:
+            return
+        path = path or event.src_path
+        if path.endswith(TURNS_SUFFIX):
+            # A conversation's turn records: ingest it per turn (its .md is written after)
+            self.process_file(path[:-len(TURNS_SUFFIX)] + '.md')
+        elif path.endswith(('.md', '.txt', '.pdf')):
+            self.process_file(path)
     
+    def save_index(self):
+        with self.lock:
+            self.dedup.save()
+        logging.info(self.dedup.report())
+
     def process_file(self, file_path):
+        with self.lock:
+            self._process_file(file_path)
+
+    def _process_file(self, file_path):
+        decisions = []
         try:
             logging.info(f"Processing file: {file_path}")
             
-            # Read file content
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            # Read file content, or its per-turn records for converted conversations
+            with timer("read"):
+                turns = load_turns(file_path)
+                if turns:
+                    items = [(f"{file_path}#{t['turn_index']}{t['text']}", t['text'], turn_metadata(t),
+                              str(t['turn_index'])) for t in turns]
+                else:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                    items = [(f"{file_path}{content}", content, file_metadata(file_path, self.root), "")]
             
-            # Create embedding
-            embedding = self.model.encode(content).tolist()
+            # Unique ID based on file path and content
+            url = file_url(file_path)
+            items = [(hashlib.md5(key.encode()).hexdigest(), text, meta, pos) for key, text, meta, pos in items]
             
-            # Create unique ID based on file path and content
-            file_id = hashlib.md5(f"{file_path}{content}".encode()).hexdigest()
+            # Skip near-duplicates before embedding; a near-duplicate edit of the same
+            # turn (or of a whole note) reuses that chunk's old row ID
+            with timer("dedup"):
+                decisions = [self.dedup.screen_text(text, url, item_id, pos) for item_id, text, _, pos in items]
+                # Rows this version of the file still points at; anything else under the url is stale
+                current = {item_id for item_id, _, _, _ in items} | {d.match_id for d in decisions if d.match_id}
+                items = [(d.match_id if d.action == "merge" else item_id, text, meta, d)
+                         for (item_id, text, meta, _), d in zip(items, decisions) if d.action in KEPT]
             
-            # Prepare data for Supabase
-            data = {
-                'id': file_id,
-                'url': f"file://{file_path}",
-                'content': content,
-                'source': 'local_file',
-                'file_name': os.path.basename(file_path),
-                'summary': content[:200] + "..." if len(content) > 200 else content,
-                'embedding': embedding
-            }
+            if items:
+                # Create embeddings
+                with timer("embed"):
+                    embeddings = self.model.encode([text for _, text, _, _ in items]).tolist()
+                
+                # Prepare records for the vector store
+                with timer("serialize"):
+                    data = []
+                    for (item_id, text, meta, d), embedding in zip(items, embeddings):
+                        d = self.dedup.screen_embedding(d, embedding, text)
+                        if d.action not in KEPT:
+                            current.add(d.match_id)
+                            continue
+                        data.append({
+                            'id': item_id,
+                            'url': url,
+                            'content': text,
+                            'source': 'local_file',
+                            'file_name': os.path.basename(file_path),
+                            'summary': text[:200] + "..." if len(text) > 200 else text,
+                            'metadata': meta,
+                            'embedding': embedding
+                        })
+                
+                # Upsert to the configured store (Supabase or local)
+                with timer("upsert"):
+                    self.store.upsert(data)
+            elif all(d.action == "unchanged" for d in decisions):
+                logging.info(f"Unchanged: {file_path}")
+            else:
+                logging.info(f"Skipped near-duplicate: {file_path}")
             
-            # Upsert to Supabase
-            result = self.supabase.table('crawled_pages').upsert(data).execute()
+            # A real edit leaves the previous version's rows behind; drop them
+            with timer("delete"):
+                stale = self.store.delete_url(url, keep=current)
+            self.dedup.discard(stale)
+            if stale:
+                count("stale_rows", len(stale))
+                logging.info(f"Removed {len(stale)} stale row(s) for {file_path}")
+            count("files")
             logging.info(f"Successfully processed: {file_path}")
             
         except Exception as e:
+            for d in decisions:
+                self.dedup.forget(d)
+            count("errors")
             logging.error(f"Error processing {file_path}: {e}")
 
 def scan_once(folder_path):
     """Scan folder once and process all files"""
-    handler = DocumentHandler()
+    handler = DocumentHandler(folder_path)
     
     for root, dirs, files in os.walk(folder_path):
         for file in files:
@@ -81,23 +160,38 @@ def scan_once(folder_path):
                 file_path = os.path.join(root, file)
                 handler.process_file(file_path)
 
+    handler.save_index()
+    logging.info(metrics.report())
+    logging.info(f"Metrics written to {metrics.export()}")
+
 def watch_daemon(folder_path):
     """Watch folder continuously"""
-    event_handler = DocumentHandler()
+    event_handler = DocumentHandler(folder_path)
     observer = Observer()
     observer.schedule(event_handler, folder_path, recursive=True)
     observer.start()
+    if STORE_BACKEND == "local":
+        event_handler.store.start_compactor()
     
     logging.info(f"Started watching: {folder_path}")
+    last_export = time.monotonic()
     
     try:
         while True:
             time.sleep(1)
+            if time.monotonic() - last_export >= METRICS_EXPORT_INTERVAL:
+                metrics.export()
+                event_handler.save_index()
+                last_export = time.monotonic()
     except KeyboardInterrupt:
         observer.stop()
         logging.info("Stopped watching")
     
     observer.join()
+    event_handler.save_index()
+    event_handler.store.close()
+    logging.info(metrics.report())
+    metrics.export()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='File watcher for AI knowledge base')
@@ -106,7 +200,7 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
-    folder_path = r"C:\AI_SecondBrain\personal_vault"
+    folder_path = os.getenv("VAULT_DIR", r"C:\AI_SecondBrain\personal_vault")
     
     # Create folder if it doesn't exist
     os.makedirs(folder_path, exist_ok=True)
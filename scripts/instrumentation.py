@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Configuration
+METRICS_DIR = Path(os.getenv("METRICS_DIR", Path(__file__).parent / "metrics"))
+METRICS_FILE = os.getenv("METRICS_FILE")  # overrides METRICS_DIR/<run>.json; use .prom for Prometheus text
+# Comma-separated stage names to run under cProfile, e.g. PROFILE_STAGES=embed,upsert
+PROFILE_STAGES = {s.strip() for s in os.getenv("PROFILE_STAGES", "").split(",") if s.strip()}
+PROFILE_DIR = METRICS_DIR / "profiles"
+MAX_SAMPLES = 10000           # per-stage reservoir for percentile estimates
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted sample list."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class Metrics:
+    """Per-stage timers and named counters for one pipeline run."""
+
+    def __init__(self, run: Optional[str] = None):
+        self.run = run or Path(sys.argv[0]).stem or "pipeline"
+        self.started = time.time()
+        self.samples: Dict[str, List[float]] = {}
+        self.totals: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._profilers: Dict[str, cProfile.Profile] = {}
+        self._profiling: Optional[str] = None   # the one stage currently under cProfile
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            n = self.calls.get(stage, 0) + 1
+            self.calls[stage] = n
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+            samples = self.samples.setdefault(stage, [])
+            if len(samples) < MAX_SAMPLES:
+                samples.append(seconds)
+            else:
+                # Reservoir sampling keeps percentiles unbiased on long runs
+                slot = int.from_bytes(os.urandom(4), "little") % n
+                if slot < MAX_SAMPLES:
+                    samples[slot] = seconds
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _start_profile(self, stage: str) -> Optional[cProfile.Profile]:
+        """
+        Enable the stage's profiler unless another profiled stage is running.
+        Nested profilers clobber each other (silently before Python 3.12), so
+        an inner stage is only timed; its calls still show up in the outer profile.
+        """
+        with self._lock:
+            if stage not in PROFILE_STAGES or self._profiling is not None:
+                return None
+            self._profiling = stage
+            profiler = self._profilers.setdefault(stage, cProfile.Profile())
+        try:
+            profiler.enable()
+        except ValueError:   # a profiler outside this module is active
+            self._profiling = None
+            return None
+        return profiler
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time a block as `stage`; profile it too if listed in PROFILE_STAGES."""
+        profiler = self._start_profile(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                self._profiling = None
+            self.record(stage, time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            stages = {}
+            for stage, samples in self.samples.items():
+                stages[stage] = {
+                    "calls": self.calls[stage],
+                    "total_s": round(self.totals[stage], 6),
+                    "mean_s": round(self.totals[stage] / self.calls[stage], 6),
+                    **{f"p{p}_s": round(percentile(samples, p), 6) for p in PERCENTILES},
+                    "max_s": round(max(samples), 6),
+                }
+            return {
+                "run": self.run,
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "wall_s": round(time.time() - self.started, 3),
+                "stages": stages,
+                "counters": dict(self.counters),
+            }
+
+    def prometheus(self) -> str:
+        """Render the summary in Prometheus text exposition format."""
+        data = self.summary()
+        run = data["run"]
+        lines = [
+            "# TYPE pipeline_stage_seconds summary",
+        ]
+        for stage, s in data["stages"].items():
+            labels = f'run="{run}",stage="{stage}"'
+            for p in PERCENTILES:
+                lines.append(f'pipeline_stage_seconds{{{labels},quantile="{p / 100}"}} {s[f"p{p}_s"]}')
+            lines.append(f"pipeline_stage_seconds_sum{{{labels}}} {s['total_s']}")
+            lines.append(f"pipeline_stage_seconds_count{{{labels}}} {s['calls']}")
+        lines.append("# TYPE pipeline_items_total counter")
+        for name, value in data["counters"].items():
+            lines.append(f'pipeline_items_total{{run="{run}",name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Optional[Path] = None) -> Path:
+        """Write metrics to `path`: Prometheus text for .prom, JSON otherwise."""
+        path = Path(path or METRICS_FILE or METRICS_DIR / f"{self.run}.json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".prom":
+            path.write_text(self.prometheus(), encoding="utf-8")
+        else:
+            path.write_text(json.dumps(self.summary(), indent=2), encoding="utf-8")
+        for stage, profiler in self._profilers.items():
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(PROFILE_DIR / f"{self.run}_{stage}.prof")
+        return path
+
+    def report(self) -> str:
+        """One line per stage, slowest total first, for console output."""
+        data = self.summary()
+        lines = [f"⏱️ Stage timings for {data['run']} (wall {data['wall_s']:.2f}s):"]
+        for stage, s in sorted(data["stages"].items(), key=lambda kv: -kv[1]["total_s"]):
+            lines.append(
+                f"   {stage:<10} total {s['total_s']:.3f}s  calls {s['calls']:<6} "
+                f"p50 {s['p50_s'] * 1000:.1f}ms  p90 {s['p90_s'] * 1000:.1f}ms  p99 {s['p99_s'] * 1000:.1f}ms"
+            )
+        if data["counters"]:
+            lines.append("   " + ", ".join(f"{k}={v}" for k, v in data["counters"].items()))
+        return "\n".join(lines)
+
+
+# Shared instance for scripts that run one pipeline per process
+metrics = Metrics()
+timer = metrics.timer
+count = metrics.count
@@ -3,9 +3,12 @@ from sentence_transformers import SentenceTransformer
 import numpy as np
 from supabase import create_client, Client
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import openai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from vector_store import STORE_BACKEND, get_store
+from instrumentation import metrics, timer, count
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -44,34 +47,37 @@ def init_supabase():
     
     return create_client(url, key)
 
-def search_knowledge_base(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-    """Search the knowledge base using vector similarity"""
+@st.cache_resource
+def init_store():
+    """Initialize the vector store (Supabase, or local files when VECTOR_STORE=local)"""
+    if STORE_BACKEND == "local":
+        return get_store()
+    return get_store(init_supabase())
+
+def search_knowledge_base(query: str, top_k: int = 5, folder: Optional[str] = None,
+                          date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Search the knowledge base using vector similarity, optionally pre-filtered by folder/date"""
     
     # Load model if not already loaded
     if st.session_state.embedding_model is None:
         st.session_state.embedding_model = load_embedding_model()
     
     # Generate embedding for query
-    embedding = st.session_state.embedding_model.encode([query])[0]
+    with timer("embed"):
+        embedding = st.session_state.embedding_model.encode([query])[0]
     embedding_list = embedding.tolist()
     
-    # Search Supabase
-    supabase = init_supabase()
+    # Search the configured vector store
+    store = init_store()
     
     try:
-        response = supabase.rpc(
-            'match_crawled_pages',
-            {
-                'query_embedding': embedding_list,
-                'match_count': top_k,
-                'match_threshold': 0.1
-            }
-        ).execute()
-print(f"Search response: {response}")
-print(f"Response data: {response.data}")
-print(f"Embedding length: {len(embedding_list)}")
+        with timer("retrieve"):
+            results = store.search(embedding_list, top_k=top_k, threshold=0.1,
+                                   folder=folder, date_from=date_from, date_to=date_to)
+        count("queries")
+        logger.info(f"Search returned {len(results)} results (embedding length: {len(embedding_list)})")
         
-        return response.data if response.data else []
+        return results
         
     except Exception as e:
         logger.error(f"Error searching knowledge base: {e}")
@@ -122,15 +128,16 @@ Here's what I found:
         # Use OpenAI to generate response
         client = openai.OpenAI(api_key=openai_key)
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # More cost-effective option
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": query}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
+        with timer("generate"):
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",  # More cost-effective option
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": query}
+                ],
+                max_tokens=1000,
+                temperature=0.7
+            )
         
         return response.choices[0].message.content
         
@@ -145,12 +152,11 @@ def main():
         
         # Knowledge base stats
         st.subheader("Knowledge Base")
-        supabase = init_supabase()
+        store = init_store()
         
         try:
             # Get total document count
-            count_response = supabase.table('crawled_pages').select('*', count='exact').execute()
-            total_docs = count_response.count if hasattr(count_response, 'count') else 0
+            total_docs = store.count()
             st.metric("Total Documents", total_docs)
         except:
             st.metric("Total Documents", "Error loading")
@@ -159,6 +165,15 @@ def main():
         st.subheader("Search Settings")
         top_k = st.slider("Documents to retrieve", 1, 10, 5)
         
+        # Metadata filters (applied before vector scoring)
+        folder_filter = st.text_input("Folder", placeholder="e.g. Motorcycle_Fixes").strip() or None
+        date_from = date_to = None
+        if st.checkbox("Filter by date"):
+            date_range = st.date_input("Date range", value=(datetime.now().date() - timedelta(days=30), datetime.now().date()))
+            if isinstance(date_range, tuple) and len(date_range) == 2:
+                date_from = date_range[0].isoformat()
+                date_to = (date_range[1] + timedelta(days=1)).isoformat()  # inclusive end day
+        
         # Clear chat
         if st.button("Clear Chat History"):
             st.session_state.messages = []
@@ -216,7 +231,7 @@ def main():
         with st.chat_message("assistant"):
             with st.spinner("Searching knowledge base..."):
                 # Search knowledge base
-                relevant_docs = search_knowledge_base(prompt, top_k)
+                relevant_docs = search_knowledge_base(prompt, top_k, folder_filter, date_from, date_to)
                 
                 if not relevant_docs:
                     response = "I couldn't find any relevant information in your knowledge base for that question."
@@ -245,6 +260,7 @@ def main():
             "content": response,
             "sources": sources if 'sources' in locals() else []
         })
+        metrics.export()
 
 if __name__ == "__main__":
     main()
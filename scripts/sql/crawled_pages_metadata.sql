@@ -0,0 +1,49 @@
+-- Filterable chunk metadata for crawled_pages (run once in the Supabase SQL editor).
+--
+-- The ingesters write metadata = {folder, created_at, conversation_id, turn_index, role, ...}.
+-- folder and created_at get expression indexes for selective filters; the filters sit in
+-- the same WHERE as the distance ordering so the planner can still use an ANN index on
+-- embedding when no filter (or a broad one) is set. created_at is ISO 8601 UTC text,
+-- which sorts correctly as a string.
+
+alter table crawled_pages add column if not exists metadata jsonb not null default '{}'::jsonb;
+
+create index if not exists crawled_pages_folder_idx
+    on crawled_pages ((metadata->>'folder') text_pattern_ops);
+create index if not exists crawled_pages_created_at_idx
+    on crawled_pages ((metadata->>'created_at'));
+
+drop function if exists match_crawled_pages(vector, int, float);
+
+create or replace function match_crawled_pages(
+    query_embedding vector(384),
+    match_count int default 5,
+    match_threshold float default 0.1,
+    filter_folder text default null,   -- matches the folder and its subfolders
+    date_from text default null,       -- inclusive, ISO 8601
+    date_to text default null          -- exclusive, ISO 8601
+)
+returns table (
+    id text,
+    url text,
+    content text,
+    summary text,
+    source text,
+    file_name text,
+    metadata jsonb,
+    similarity float
+)
+language sql stable
+as $$
+    select c.id::text, c.url, c.content, c.summary, c.source, c.file_name, c.metadata,
+           1 - (c.embedding <=> query_embedding) as similarity
+    from crawled_pages c
+    where (filter_folder is null
+           or c.metadata->>'folder' = filter_folder
+           or starts_with(c.metadata->>'folder', filter_folder || '/'))   -- not LIKE: '_' is a wildcard
+      and (date_from is null or c.metadata->>'created_at' >= date_from)
+      and (date_to is null or c.metadata->>'created_at' < date_to)
+      and 1 - (c.embedding <=> query_embedding) > match_threshold
+    order by c.embedding <=> query_embedding
+    limit match_count;
+$$;
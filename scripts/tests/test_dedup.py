@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from dedup import Deduplicator, index_path
+from vector_store import LocalVectorStore
+
+TEXT = " ".join(f"word{i}" for i in range(300))
+EDIT = TEXT.replace("word150", "changed150")
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = LocalVectorStore(tmp_path / "crawled_pages")
+    s.upsert([{"id": "seed", "url": "file:///seed.md", "content": "seed", "embedding": [1.0, 0.0]}])
+    yield s
+    s.close()
+
+
+def dedup(store, **kwargs):
+    return Deduplicator("test", store, enabled=True, **kwargs)
+
+
+def test_unchanged_reingest_is_not_counted_as_removed(store):
+    d = dedup(store)
+    assert d.screen_text(TEXT, "file:///a.md", "a#0").action == "keep"
+    decision = d.screen_text(TEXT, "file:///a.md", "a#0")
+    assert decision.action == "unchanged" and decision.match_id == "a#0"
+    assert d.stats["unchanged"] == 1
+    assert d.stats["skipped"] == 0 and d.stats["chars_removed"] == 0
+
+
+@pytest.mark.parametrize("edited", [EDIT, "a complete rewrite of the note"])
+def test_same_id_edit_merges_into_its_row(store, edited):
+    d = dedup(store)
+    d.screen_text(TEXT, "file:///a.md", "a#0")
+    decision = d.screen_text(edited, "file:///a.md", "a#0")
+    assert (decision.action, decision.match_id) == ("merge", "a#0")
+    assert d.screen_text(edited, "file:///a.md", "a#0").action == "unchanged"
+
+
+def test_cross_file_near_duplicate_is_skipped(store):
+    d = dedup(store, merge_same_source=True)
+    d.screen_text(TEXT, "file:///a.md", "a#0")
+    decision = d.screen_text(EDIT, "file:///b.md", "b#0")
+    assert (decision.action, decision.match_id) == ("skip", "a#0")
+    assert d.stats["chars_removed"] == len(EDIT)
+
+
+def test_same_source_merge_needs_same_position(store):
+    d = dedup(store, merge_same_source=True)
+    d.screen_text(TEXT, "file:///c.md", "h1", "3")
+    assert d.screen_text(EDIT, "file:///c.md", "h2", "4").action == "skip"
+    merged = d.screen_text(EDIT, "file:///c.md", "h3", "3")
+    assert (merged.action, merged.match_id) == ("merge", "h1")
+    # Once merged, the same text again is identical to the stored row
+    assert d.screen_text(EDIT, "file:///c.md", "h3", "3").action == "skip"
+
+
+def test_forget_undoes_keep_and_merge(store):
+    d = dedup(store)
+    kept = d.screen_text(TEXT, "file:///a.md", "a#0")
+    d.forget(kept)
+    assert d.screen_text(TEXT, "file:///a.md", "a#0").action == "keep"
+
+    merged = d.screen_text(EDIT, "file:///a.md", "a#0")
+    d.forget(merged)
+    assert d.screen_text(EDIT, "file:///a.md", "a#0").action == "merge"
+
+
+def test_embedding_check_skips_lsh_candidate(store):
+    d = dedup(store)
+    first = d.screen_text(TEXT, "file:///a.md", "a#0")
+    d.screen_embedding(first, [1.0, 0.0, 0.0])
+    # Shares most shingles (an LSH band) but stays under the Jaccard threshold
+    reworded = " ".join(w if i % 10 else "x" for i, w in enumerate(TEXT.split()))
+    second = d.screen_text(reworded, "file:///b.md", "b#0")
+    assert second.action == "keep"
+    assert d.screen_embedding(second, [1.0, 0.0, 0.001]).action == "skip"
+
+
+def test_ingesters_share_one_index_per_store(store, tmp_path):
+    assert index_path("personal_vault", store) == index_path("local_file", store) == store.root / "dedup.npz"
+
+    a, b = dedup(store), dedup(store)
+    a.screen_text(TEXT, "file:///a.md", "a#0")
+    b.screen_text("something else entirely " * 20, "file:///b.md", "b#0")
+    a.save()
+    b.save()
+    assert sorted(dedup(store).ids) == ["a#0", "b#0"]
+
+    b.discard(["a#0"])   # b deleted a's row from the store
+    b.save()
+    a.save()             # a's untouched copy must not bring it back
+    assert dedup(store).ids == ["b#0"]
+
+
+def test_empty_store_starts_a_fresh_index(tmp_path):
+    s = LocalVectorStore(tmp_path / "empty")
+    d = Deduplicator("test", s, enabled=True)
+    d.screen_text(TEXT, "file:///a.md", "a#0")
+    d.save()
+    assert Deduplicator("test", s, enabled=True).ids == []
+    s.close()
@@ -0,0 +1,22 @@
+import pstats
+
+import instrumentation
+from instrumentation import Metrics
+
+
+def after_inner():
+    return sorted(range(1000), key=lambda x: -x)
+
+
+def test_nested_profiled_stage_keeps_outer_profile(monkeypatch):
+    monkeypatch.setattr(instrumentation, "PROFILE_STAGES", {"chunk", "tokenize"})
+    m = Metrics("test")
+    with m.timer("chunk"):
+        with m.timer("tokenize"):
+            sum(range(1000))
+        after_inner()
+
+    assert list(m._profilers) == ["chunk"]
+    profiled = {func for _, _, func in pstats.Stats(m._profilers["chunk"]).stats}
+    assert "after_inner" in profiled
+    assert set(m.summary()["stages"]) == {"chunk", "tokenize"}
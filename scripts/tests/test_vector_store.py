@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from vector_store import LocalVectorStore
+
+
+def unit(rng, n, dim=8):
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def records(vecs, prefix="c", **meta):
+    return [{"id": f"{prefix}{i}", "url": f"file:///{prefix}.md", "content": f"{prefix} {i}",
+             "metadata": dict(meta), "embedding": v.tolist()} for i, v in enumerate(vecs)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = LocalVectorStore(tmp_path / "store", segment_rows=4)
+    yield s
+    s.close()
+
+
+def test_search_matches_brute_force(store):
+    rng = np.random.default_rng(0)
+    vecs = unit(rng, 30)
+    store.upsert(records(vecs))
+    store.delete([f"c{i}" for i in range(0, 30, 3)])
+    live = [i for i in range(30) if i % 3]
+    query = rng.standard_normal(8)
+
+    scores = vecs[live] @ (query / np.linalg.norm(query))
+    expected = [f"c{live[i]}" for i in np.argsort(-scores)[:5]]
+    assert [r["id"] for r in store.search(query, top_k=5, threshold=-1)] == expected
+
+
+def test_compact_remaps_slots(store):
+    rng = np.random.default_rng(1)
+    vecs = unit(rng, 10)
+    store.upsert(records(vecs))           # segments 1, 2 full; 3 active
+    store.delete(["c0", "c1", "c2"])      # 3/4 of segment 1 tombstoned
+    first = store._segment_path(1)
+
+    assert store.compact() == 1
+    assert not first.exists()
+    assert store.count() == 7
+    for i in range(3, 10):
+        hit = store.search(vecs[i], top_k=1, threshold=-1)[0]
+        assert hit["id"] == f"c{i}"
+        assert hit["similarity"] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_failed_upsert_rolls_back(store):
+    rng = np.random.default_rng(2)
+    vecs = unit(rng, 2)
+    store.upsert(records(vecs[:1]))
+    size = store._segment_path(1).stat().st_size
+
+    bad = records(vecs)
+    bad[1]["content"] = object()          # fails at INSERT, after tombstone and append
+    with pytest.raises(Exception):
+        store.upsert(bad)
+
+    assert store.count() == 1
+    assert store._segment_path(1).stat().st_size == size
+    assert store.search(vecs[0], top_k=1, threshold=-1)[0]["id"] == "c0"
+
+
+def test_folder_filter_matches_subfolders_only(store):
+    rng = np.random.default_rng(3)
+    for prefix, folder in [("a", "AI_System_Building"), ("b", "AI_System_Building/HowTo"),
+                           ("c", "AI_System_Buildings"), ("d", "AIxSystem_Building")]:
+        store.upsert(records(unit(rng, 1), prefix, folder=folder, created_at="2024-01-01T00:00:00+00:00"))
+
+    hits = store.search(rng.standard_normal(8), top_k=10, threshold=-1, folder="AI_System_Building")
+    assert sorted(r["id"] for r in hits) == ["a0", "b0"]
+    assert store.search(rng.standard_normal(8), top_k=10, threshold=-1, date_from="2025-01-01") == []
+
+
+def test_delete_url_keeps_listed_ids(store):
+    rng = np.random.default_rng(4)
+    store.upsert(records(unit(rng, 3)))
+    assert sorted(store.delete_url("file:///c.md", keep=["c1"])) == ["c0", "c2"]
+    assert store.count() == 1
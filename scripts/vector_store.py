@@ -0,0 +1,496 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterable
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+STORE_BACKEND = os.getenv("VECTOR_STORE", "supabase")  # "supabase" or "local"
+LOCAL_STORE_DIR = Path(os.getenv("LOCAL_STORE_DIR", Path(__file__).parent.parent / "local_store"))
+SEGMENT_ROWS = 65536          # rows per segment file before rolling over
+COMPACT_DEAD_RATIO = 0.3      # rewrite a sealed segment once this share of rows is tombstoned
+BATCH_SIZE = 50
+
+
+def chunk_id(record: Dict[str, Any]) -> str:
+    """Stable id for a chunk: explicit id if present, else hash of url + content."""
+    if record.get("id"):
+        return str(record["id"])
+    url = record.get("url") or record.get("metadata", {}).get("path", "")
+    return hashlib.md5(f"{url}{record.get('content', '')}".encode()).hexdigest()
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive lock on `path` across processes (blocks until acquired)."""
+    with open(path, "a+b") as fh:
+        if fcntl:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def top_k_indices(scores: np.ndarray, top_k: int, threshold: float) -> np.ndarray:
+    """Indices of the top_k scores at or above threshold, best first."""
+    hits = np.flatnonzero(scores >= threshold)
+    if top_k <= 0:
+        return hits[:0]
+    if len(hits) > top_k:
+        hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+    return hits[np.argsort(-scores[hits], kind="stable")]
+
+
+def filter_clause(folder: Optional[str] = None, date_from: Optional[str] = None,
+                  date_to: Optional[str] = None) -> tuple:
+    """
+    SQL WHERE clause over the indexed folder/created_at columns.
+    `folder` also matches its subfolders; dates are ISO strings, date_to exclusive.
+    """
+    clauses, params = [], []
+    if folder:
+        folder = folder.strip("/")
+        # Range instead of LIKE so the index is used ('0' sorts right after '/')
+        clauses.append("(folder = ? OR (folder >= ? AND folder < ?))")
+        params += [folder, folder + "/", folder + "0"]
+    if date_from:
+        clauses.append("created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("created_at < ?")
+        params.append(date_to)
+    return " AND ".join(clauses) or "1", params
+
+
+class VectorStore:
+    """Common interface shared by the Supabase and local backends."""
+
+    def upsert(self, records: List[Dict[str, Any]]) -> int:
+        raise NotImplementedError
+
+    def delete(self, ids: Iterable[str]) -> int:
+        raise NotImplementedError
+
+    def delete_url(self, url: str, keep: Iterable[str] = ()) -> List[str]:
+        """Delete every row for `url` except the `keep` ids; returns the deleted ids."""
+        raise NotImplementedError
+
+    def search(self, query_embedding: List[float], top_k: int = 5, threshold: float = 0.1,
+               folder: Optional[str] = None, date_from: Optional[str] = None,
+               date_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SupabaseStore(VectorStore):
+    """
+    Writes to a Supabase table, searches through the match_crawled_pages RPC.
+    `url_field` is the column delete_url() matches on (a JSON path such as
+    "metadata->>path" for tables without a url column).
+    """
+
+    def __init__(self, client, table: str = "crawled_pages", rpc: str = "match_crawled_pages",
+                 url_field: str = "url"):
+        self.client = client
+        self.table = table
+        self.rpc = rpc
+        self.url_field = url_field
+
+    def upsert(self, records):
+        written = 0
+        for i in range(0, len(records), BATCH_SIZE):
+            batch = records[i:i+BATCH_SIZE]
+            self.client.table(self.table).upsert(batch).execute()
+            written += len(batch)
+        return written
+
+    def delete(self, ids):
+        ids = list(ids)
+        if ids:
+            self.client.table(self.table).delete().in_("id", ids).execute()
+        return len(ids)
+
+    def delete_url(self, url, keep=()):
+        query = self.client.table(self.table).delete().eq(self.url_field, url)
+        keep = list(keep)
+        if keep:
+            query = query.not_.in_("id", keep)
+        response = query.execute()
+        return [str(row["id"]) for row in response.data or []]
+
+    def search(self, query_embedding, top_k=5, threshold=0.1,
+               folder=None, date_from=None, date_to=None):
+        params = {
+            'query_embedding': list(query_embedding),
+            'match_count': top_k,
+            'match_threshold': threshold
+        }
+        # Filter arguments need the updated RPC from sql/crawled_pages_metadata.sql
+        filters = {'filter_folder': folder, 'date_from': date_from, 'date_to': date_to}
+        params.update({k: v for k, v in filters.items() if v})
+        response = self.client.rpc(self.rpc, params).execute()
+        return response.data if response.data else []
+
+    def count(self):
+        response = self.client.table(self.table).select('id', count='exact').limit(1).execute()
+        return response.count if hasattr(response, 'count') else 0
+
+
+class LocalVectorStore(VectorStore):
+    """
+    On-disk store: append-only float32 segment files (read back via memmap)
+    plus a SQLite file holding chunk metadata and the id -> (segment, row) map.
+
+    Vectors are L2-normalised on write so search is a plain dot product.
+    Overwritten or deleted rows stay in their segment as tombstones until
+    compact() rewrites the segment. Writers (ingesters, the watcher,
+    compaction) serialise on an exclusive lock file so several processes
+    can share one store.
+    """
+
+    def __init__(self, root: Path = LOCAL_STORE_DIR, segment_rows: int = SEGMENT_ROWS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_rows = segment_rows
+        self._lock = threading.RLock()
+        self._compactor = None
+        self._stop = threading.Event()
+
+        self.db = sqlite3.connect(self.root / "meta.db", timeout=30, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY, rows INTEGER NOT NULL DEFAULT 0,
+                dead INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY, segment INTEGER NOT NULL, row INTEGER NOT NULL,
+                url TEXT, content TEXT, metadata TEXT, folder TEXT, created_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS chunks_segment ON chunks (segment, row);
+        """)
+        # Stores created before folder/created_at were indexed
+        columns = {c[1] for c in self.db.execute("PRAGMA table_info(chunks)")}
+        for column in ("folder", "created_at"):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE chunks ADD COLUMN {column} TEXT")
+        self.db.executescript("""
+            CREATE INDEX IF NOT EXISTS chunks_folder ON chunks (folder, created_at);
+            CREATE INDEX IF NOT EXISTS chunks_created ON chunks (created_at);
+            CREATE INDEX IF NOT EXISTS chunks_url ON chunks (url);
+        """)
+        self.db.commit()
+        self.dim = None
+        self._read_dim()
+        self._live = None           # segment -> (row -> id array, live mask); see _live_rows()
+        self._live_version = None
+
+    def _read_dim(self) -> Optional[int]:
+        """Pick up the dimension lazily: another process may have done the first upsert."""
+        if self.dim is None:
+            row = self.db.execute("SELECT value FROM settings WHERE key = 'dim'").fetchone()
+            self.dim = int(row[0]) if row else None
+        return self.dim
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive across threads (RLock) and processes (lock file)."""
+        with self._lock, file_lock(self.root / "write.lock"):
+            try:
+                yield
+            finally:
+                self._live = None   # our own writes don't bump PRAGMA data_version
+
+    # -- segment helpers -------------------------------------------------
+
+    def _segment_path(self, seg: int) -> Path:
+        return self.root / f"seg_{seg:05d}.f32"
+
+    def _file_rows(self, seg: int) -> int:
+        path = self._segment_path(seg)
+        return path.stat().st_size // (4 * self.dim) if path.exists() else 0
+
+    def _active_segment(self) -> int:
+        row = self.db.execute("SELECT id FROM segments ORDER BY id DESC LIMIT 1").fetchone()
+        if row and self._file_rows(row[0]) < self.segment_rows:
+            return row[0]
+        seg = (row[0] + 1) if row else 1
+        self.db.execute("INSERT INTO segments (id) VALUES (?)", (seg,))
+        return seg
+
+    def _live_rows(self) -> Dict[int, tuple]:
+        """
+        Per segment, an array mapping row -> chunk id and a mask of live rows.
+        Rebuilt only when the store changed: our writes clear it, other
+        processes' commits show up in PRAGMA data_version. Call under _lock.
+        """
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if self._live is None or version != self._live_version:
+            live = {}
+            for seg, rows in self.db.execute("SELECT id, rows FROM segments"):
+                live[seg] = (np.empty(rows, dtype=object), np.zeros(rows, dtype=bool))
+            for seg, row, cid in self.db.execute("SELECT segment, row, id FROM chunks"):
+                ids, mask = live[seg]
+                if row < len(mask):
+                    ids[row], mask[row] = cid, True
+            self._live, self._live_version = live, version
+        return self._live
+
+    def _load_segment(self, seg: int) -> Optional[np.ndarray]:
+        path = self._segment_path(seg)
+        if not path.exists() or path.stat().st_size == 0:
+            return None
+        rows = path.stat().st_size // (4 * self.dim)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def _append_vectors(self, vectors: np.ndarray, undo: List[tuple]) -> List[tuple]:
+        """
+        Append vectors across segments; return their (segment, row) slots.
+        Slots come from the file offset, not a counter, so the file is the
+        source of truth. (path, size before) pairs go to `undo` so a failed
+        transaction can truncate what it wrote. Call under _write_lock().
+        """
+        row_bytes = 4 * self.dim
+        slots = []
+        start = 0
+        while start < len(vectors):
+            seg = self._active_segment()
+            path = self._segment_path(seg)
+            with open(path, "a+b") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size % row_bytes:
+                    # Torn write from a crashed writer: drop the partial row
+                    size -= size % row_bytes
+                    f.truncate(size)
+                undo.append((path, size))
+                used = size // row_bytes
+                take = min(self.segment_rows - used, len(vectors) - start)
+                f.write(vectors[start:start+take].tobytes())
+            self.db.execute("UPDATE segments SET rows = ? WHERE id = ?", (used + take, seg))
+            slots.extend((seg, used + r) for r in range(take))
+            start += take
+        return slots
+
+    @staticmethod
+    def _undo_appends(undo: List[tuple]):
+        for path, size in reversed(undo):
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def _tombstone(self, ids: List[str]) -> int:
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        dead = self.db.execute(
+            f"SELECT segment, COUNT(*) FROM chunks WHERE id IN ({marks}) GROUP BY segment", ids
+        ).fetchall()
+        for seg, n in dead:
+            self.db.execute("UPDATE segments SET dead = dead + ? WHERE id = ?", (n, seg))
+        self.db.execute(f"DELETE FROM chunks WHERE id IN ({marks})", ids)
+        return sum(n for _, n in dead)
+
+    # -- public API ------------------------------------------------------
+
+    def upsert(self, records):
+        if not records:
+            return 0
+        # Last write wins when the same chunk appears twice in one batch
+        records = list({chunk_id(r): r for r in records}.values())
+        vectors = np.asarray([r["embedding"] for r in records], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        # Serialise everything up front so a bad record fails before any write
+        ids = [chunk_id(r) for r in records]
+        rows = []
+        for cid, record in zip(ids, records):
+            extra = {k: v for k, v in record.items() if k not in ("id", "url", "content", "embedding")}
+            meta = record.get("metadata") or {}
+            url = record.get("url") or meta.get("path")   # same fallback as chunk_id
+            rows.append([cid, None, None, url, record.get("content"), json.dumps(extra),
+                         meta.get("folder"), meta.get("created_at")])
+
+        with self._write_lock():
+            if self._read_dim() is None:
+                self.dim = vectors.shape[1]
+                with self.db:
+                    self.db.execute("INSERT INTO settings VALUES ('dim', ?)", (str(self.dim),))
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}")
+
+            undo = []
+            try:
+                with self.db:   # commits on success, rolls back tombstones and counters on error
+                    self._tombstone(ids)
+                    slots = self._append_vectors(vectors, undo)
+                    for row, (seg, slot) in zip(rows, slots):
+                        row[1], row[2] = seg, slot
+                    self.db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            except BaseException:
+                self._undo_appends(undo)
+                raise
+        return len(records)
+
+    def delete(self, ids):
+        with self._write_lock(), self.db:
+            removed = self._tombstone(list(ids))
+        return removed
+
+    def delete_url(self, url, keep=()):
+        keep = set(keep)
+        with self._write_lock(), self.db:
+            ids = [cid for (cid,) in self.db.execute("SELECT id FROM chunks WHERE url = ?", (url,))
+                   if cid not in keep]
+            self._tombstone(ids)
+        return ids
+
+    def search(self, query_embedding, top_k=5, threshold=0.1,
+               folder=None, date_from=None, date_to=None):
+        if self._read_dim() is None:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+
+        with self._lock:
+            candidates = []   # (scores, ids) of each segment's local top_k
+            if folder or date_from or date_to:
+                # Metadata pre-filter runs on the SQLite indexes; only survivors are scored
+                where, params = filter_clause(folder, date_from, date_to)
+                by_segment: Dict[int, List[tuple]] = {}
+                for seg, row, cid in self.db.execute(
+                    f"SELECT segment, row, id FROM chunks WHERE {where} ORDER BY segment, row", params
+                ):
+                    by_segment.setdefault(seg, []).append((row, cid))
+                for seg, live in by_segment.items():
+                    vectors = self._load_segment(seg)
+                    if vectors is None:
+                        continue
+                    rows = np.fromiter((r for r, _ in live), dtype=np.int64, count=len(live))
+                    scores = vectors[rows] @ query
+                    best = top_k_indices(scores, top_k, threshold)
+                    candidates.append((scores[best], [live[b][1] for b in best]))
+            else:
+                # No filter: score each memmapped segment whole, masking tombstones
+                for seg, (ids, mask) in self._live_rows().items():
+                    vectors = self._load_segment(seg)
+                    if vectors is None or not mask.any():
+                        continue
+                    n = min(len(vectors), len(mask))
+                    scores = vectors[:n] @ query
+                    scores[~mask[:n]] = -np.inf
+                    best = top_k_indices(scores, top_k, threshold)
+                    candidates.append((scores[best], ids[best].tolist()))
+
+            if not candidates:
+                return []
+            scores = np.concatenate([c[0] for c in candidates])
+            ids = [cid for c in candidates for cid in c[1]]
+            best = top_k_indices(scores, top_k, threshold)
+            marks = ",".join("?" * len(best))
+            rows = {row[0]: row for row in self.db.execute(
+                f"SELECT id, url, content, metadata FROM chunks WHERE id IN ({marks})", [ids[b] for b in best]
+            )}
+            results = []
+            for b in best:
+                cid, url, content, metadata = rows[ids[b]]
+                doc = json.loads(metadata or "{}")
+                doc.update({"id": cid, "url": url, "content": content, "similarity": float(scores[b])})
+                results.append(doc)
+        return results
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def compact(self, dead_ratio: float = COMPACT_DEAD_RATIO) -> int:
+        """Rewrite sealed segments whose tombstone share exceeds dead_ratio."""
+        compacted = 0
+        with self._write_lock():
+            if self._read_dim() is None:
+                return 0
+            active = self.db.execute("SELECT MAX(id) FROM segments").fetchone()[0]
+            sealed = self.db.execute(
+                "SELECT id, rows, dead FROM segments WHERE id != ? AND rows > 0", (active,)
+            ).fetchall()
+            for seg, rows, dead in sealed:
+                if dead / rows < dead_ratio:
+                    continue
+                undo = []
+                try:
+                    with self.db:
+                        live = self.db.execute("SELECT row, id FROM chunks WHERE segment = ?", (seg,)).fetchall()
+                        if live:
+                            vectors = self._load_segment(seg)
+                            moved = np.array(vectors[[r for r, _ in live]])
+                            del vectors
+                            slots = self._append_vectors(moved, undo)
+                            self.db.executemany(
+                                "UPDATE chunks SET segment = ?, row = ? WHERE id = ?",
+                                [(s, r, cid) for (s, r), (_, cid) in zip(slots, live)]
+                            )
+                        self.db.execute("DELETE FROM segments WHERE id = ?", (seg,))
+                except BaseException:
+                    self._undo_appends(undo)
+                    raise
+                self._segment_path(seg).unlink(missing_ok=True)
+                compacted += 1
+                logger.info(f"Compacted segment {seg}: {dead}/{rows} rows were tombstoned")
+        return compacted
+
+    def start_compactor(self, interval: float = 300):
+        """Run compact() every `interval` seconds on a daemon thread."""
+        if self._compactor:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.compact()
+                except Exception as e:
+                    logger.error(f"Compaction failed: {e}")
+
+        self._compactor = threading.Thread(target=loop, name="vector-store-compactor", daemon=True)
+        self._compactor.start()
+
+    def close(self):
+        self._stop.set()
+        if self._compactor:
+            self._compactor.join()
+            self._compactor = None
+        self.db.close()
+
+
+def get_store(supabase_client=None, table: str = "crawled_pages",
+              backend: str = STORE_BACKEND, url_field: str = "url") -> VectorStore:
+    """Return the configured backend (VECTOR_STORE=supabase|local)."""
+    if backend == "local":
+        return LocalVectorStore(LOCAL_STORE_DIR / table)
+    if supabase_client is None:
+        raise ValueError("Supabase backend selected but no client was given")
+    return SupabaseStore(supabase_client, table, url_field=url_field)